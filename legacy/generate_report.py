@@ -3,11 +3,13 @@
 """
 读取 merged.csv，输出 financial_report.pdf（最近12个月，按“近→远”）
 包含：每月 KPI、支出分类、Top 商家（支出）、大额支出明细。
-依赖：pandas, fpdf2
+依赖：pandas, fpdf2（可选 pyarrow：优先读取 merge_bills 同时写出的 merged.parquet）
 """
 
 import os
+import importlib.util
 from datetime import datetime
+import numpy as np
 import pandas as pd
 from fpdf import FPDF, XPos, YPos
 
@@ -29,6 +31,7 @@ FONT_CANDIDATES = [
     r"./fonts/NotoSansSC-Regular.otf",
 ]
 FONT_FAMILY_NAME = "CJK"  # 在PDF中注册后的统一字体名
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None  # 读取 Parquet 缓存
 # ==========================
 
 
@@ -47,8 +50,9 @@ class ReportPDF(FPDF):
         self.set_auto_page_break(auto=True, margin=12)
         self.font_path = font_path
         if font_path:
-            self.add_font(FONT_FAMILY_NAME, "", font_path, uni=True)
-            self.add_font(FONT_FAMILY_NAME, "B", font_path, uni=True)
+            # 只注册一次（fpdf2 已不需要 uni=True，嵌入时按实际用到的字形子集化）。
+            # 候选字体都没有单独的粗体文件，标题靠字号区分，不再把同一文件重复注册为 "B"。
+            self.add_font(FONT_FAMILY_NAME, "", font_path)
             self.set_font(FONT_FAMILY_NAME, "", 12)
         else:
             # 若未找到中文字体：仍设英文字体，但中文将无法渲染（建议提供字体）
@@ -60,49 +64,62 @@ class ReportPDF(FPDF):
         return self.w - self.l_margin - self.r_margin
 
     def h1(self, text: str):
-        self.set_font(FONT_FAMILY_NAME, "B", 18)
-        self.cell(0, 10, txt=text, new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
+        self.set_font(FONT_FAMILY_NAME, "", 18)
+        self.cell(0, 10, text, new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
         self.ln(2)
         self.set_font(FONT_FAMILY_NAME, "", 12)
 
     def h2(self, text: str):
-        self.set_font(FONT_FAMILY_NAME, "B", 15)
-        self.cell(0, 9, txt=text, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        self.set_font(FONT_FAMILY_NAME, "", 15)
+        self.cell(0, 9, text, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         self.set_font(FONT_FAMILY_NAME, "", 12)
 
     def h3(self, text: str):
-        self.set_font(FONT_FAMILY_NAME, "B", 13)
-        self.cell(0, 8, txt=text, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        self.set_font(FONT_FAMILY_NAME, "", 13)
+        self.cell(0, 8, text, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         self.set_font(FONT_FAMILY_NAME, "", 12)
 
     def table(self, title: str, data: list[list], headers: list[str], col_widths: list[float] | None = None):
         """简单表格（不自动换行，长文本会截断以避免溢出）。"""
         if title:
-            self.set_font(FONT_FAMILY_NAME, "B", 12)
-            self.cell(0, 7, txt=title, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            self.set_font(FONT_FAMILY_NAME, "", 12)
+            self.cell(0, 7, title, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
             self.set_font(FONT_FAMILY_NAME, "", 12)
 
         if col_widths is None:
             col_widths = [self.epw / len(headers)] * len(headers)
 
-        # 表头
+        # 按当前字体实测宽度截断：每列可用宽度（扣掉左右内边距）与省略号宽度只算一次
+        max_ws = [w - 2 * self.c_margin for w in col_widths]
+        ellipsis_w = self.get_string_width("…")
+
+        # 表头（文本走位置参数：fpdf2 对已废弃的 txt= 每次调用都发警告，表格里逐格开销明显）
         self.set_fill_color(230, 230, 230)
         for w, h in zip(col_widths, headers):
-            self.cell(w, 8, txt=str(h), border=1, fill=True)
+            self.cell(w, 8, str(h), border=1, fill=True)
         self.ln(8)
 
         # 表体
         for row in data:
-            for w, cell in zip(col_widths, row):
-                text = str(cell)
-                # 简单截断（更精细可用 string_width 测宽）
-                max_chars = max(1, int(w / 3.0))
-                if len(text) > max_chars:
-                    text = text[:max_chars - 1] + "…"
-                self.cell(w, 8, txt=text, border=1)
+            for w, max_w, value in zip(col_widths, max_ws, row):
+                text = str(value)
+                if self.get_string_width(text) > max_w:
+                    text = self._fit_prefix(text, max_w - ellipsis_w) + "…"
+                self.cell(w, 8, text, border=1)
             self.ln(8)
         self.ln(2)
 
+    def _fit_prefix(self, text: str, avail: float) -> str:
+        """二分查找宽度不超过 avail 的最长前缀（前缀宽度随长度单调不减）。"""
+        lo, hi = 0, len(text)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.get_string_width(text[:mid]) <= avail:
+                lo = mid
+            else:
+                hi = mid - 1
+        return text[:lo]
+
 
 def fmt_money(x: float) -> str:
     return f"{CURRENCY}{(round(float(x) * 100) / 100):.2f}"
@@ -111,7 +128,19 @@ def fmt_money(x: float) -> str:
 def load_data(path: str) -> pd.DataFrame:
     if not os.path.exists(path):
         raise FileNotFoundError(f"未找到文件：{path}")
-    df = pd.read_csv(path, encoding="utf-8-sig", parse_dates=["date"])
+    df = None
+    # 与 CSV 同名的 Parquet 副本：不比 CSV 旧时优先读取（CSV 被手工改过则以 CSV 为准）
+    pq_path = os.path.splitext(path)[0] + ".parquet"
+    if HAS_PYARROW and os.path.exists(pq_path) and os.path.getmtime(pq_path) >= os.path.getmtime(path):
+        try:
+            df = pd.read_parquet(pq_path)
+            # 缺失值统一成 NaN，与读 CSV 时一致
+            for c in df.columns[df.dtypes == object]:
+                df[c] = df[c].where(df[c].notna(), np.nan)
+        except Exception:
+            df = None
+    if df is None:
+        df = pd.read_csv(path, encoding="utf-8-sig", parse_dates=["date"])
     # 清洗列名 & 校验
     df.columns = [str(c).replace("\ufeff", "").strip() for c in df.columns]
     need = ["date","type","category","subcategory","amount","platform","merchant","item","method","status","note"]
@@ -120,29 +149,73 @@ def load_data(path: str) -> pd.DataFrame:
         raise ValueError(f"缺少列：{', '.join(miss)}")
     # 只保留有效行
     df = df.dropna(subset=["date", "amount"]).copy()
-    df["month"] = df["date"].dt.to_period("M")
+    # 收支标记始终按 type 现算（整列一次比较），手工改过 type 的行也能正确归类
+    df["is_expense"] = df["type"].astype(str).str.contains("支出", na=False)
+    # 低基数文本列用 category 存储
+    for c in ["type", "category", "platform"]:
+        df[c] = df[c].astype("category")
+    # 年月键：year*12 + month-1（int32），按月筛选/分组都是整数比较
+    d = df["date"]
+    df["ym"] = d.dt.year.astype("int32") * 12 + d.dt.month.astype("int32") - 1
     return df
 
 
-def month_periods_recent(n: int) -> list[pd.Period]:
-    """返回 [本月, 上月, …] 共 n 个 Period('M')，用于“近→远”顺序输出。"""
-    now = pd.Period(datetime.now(), freq="M")
-    return [now - i for i in range(n)]
-
-
-def add_month_section(pdf: ReportPDF, df: pd.DataFrame, period_m: pd.Period):
-    dfm = df[df["month"] == period_m]
-    if dfm.empty:
+def month_periods_recent(n: int) -> list[int]:
+    """返回 [本月, 上月, …] 共 n 个年月键（见 load_data 的 ym 列），用于“近→远”顺序输出。"""
+    now = datetime.now()
+    now_ym = now.year * 12 + now.month - 1
+    return [now_ym - i for i in range(n)]
+
+
+def ym_label(ym: int) -> str:
+    """年月键 -> 'YYYY-MM'。"""
+    return f"{ym // 12:04d}-{ym % 12 + 1:02d}"
+
+
+def summarize_months(df: pd.DataFrame) -> dict:
+    """一次性完成所有月份的分组聚合，返回 {年月键: 当月汇总}。
+    当月汇总含：exp_total / inc_total、has_exp、cats（分类支出，降序）、
+    merchants（Top 商家支出）、big（大额支出明细 DataFrame）。
+    """
+    exp = df[df["is_expense"]]
+    inc = df[~df["is_expense"]]
+
+    exp_total = exp.groupby("ym")["amount"].sum()
+    inc_total = inc.groupby("ym")["amount"].sum()
+    by_cat = exp.groupby(["ym", "category"], observed=True)["amount"].sum()
+    by_mer = exp.groupby(["ym", "merchant"])["amount"].sum()
+
+    big_src = exp[exp["amount"] >= BIG_MIN] if BIG_MIN > 0 else exp
+    # nlargest 用有界堆取前 K 条，不必为了 Top N 把整月支出完整排序
+    big = {m: g.nlargest(BIG_TOP, "amount") for m, g in big_src.groupby("ym")}
+    cats = {m: s.droplevel("ym").sort_values(ascending=False) for m, s in by_cat.groupby(level="ym")}
+    merchants = {m: s.droplevel("ym").sort_values(ascending=False).head(TOP_MERCHANTS)
+                 for m, s in by_mer.groupby(level="ym")}
+
+    empty_sum = pd.Series(dtype=float)
+    summary = {}
+    for m in df["ym"].unique():
+        summary[m] = {
+            "exp_total": float(exp_total.get(m, 0.0)),
+            "inc_total": float(inc_total.get(m, 0.0)),
+            "has_exp": m in exp_total.index,
+            "cats": cats.get(m, empty_sum),
+            "merchants": merchants.get(m, empty_sum),
+            "big": big.get(m, exp.iloc[:0]),
+        }
+    return summary
+
+
+def add_month_section(pdf: ReportPDF, summary: dict, ym: int):
+    ms = summary.get(ym)
+    if ms is None:
         return
 
     # 标题：YYYY-MM
-    pdf.h2(str(period_m))
-
-    exp = dfm[dfm["type"].astype(str).str.contains("支出", na=False)]
-    inc = dfm[dfm["type"].astype(str).str.contains("收入", na=False)]
+    pdf.h2(ym_label(ym))
 
-    exp_total = float(exp["amount"].sum())
-    inc_total = float(inc["amount"].sum())
+    exp_total = ms["exp_total"]
+    inc_total = ms["inc_total"]
     net_total = inc_total - exp_total
 
     # KPI
@@ -159,11 +232,8 @@ def add_month_section(pdf: ReportPDF, df: pd.DataFrame, period_m: pd.Period):
 
     # 支出分类
     pdf.h3("支出分类")
-    if not exp.empty:
-        cats = (exp.groupby("category")["amount"]
-                  .sum()
-                  .sort_values(ascending=False))
-        cat_rows = [[k, fmt_money(v)] for k, v in cats.items()]
+    if ms["has_exp"]:
+        cat_rows = [[k, fmt_money(v)] for k, v in ms["cats"].items()]
         pdf.table(
             title="",
             headers=["分类", "金额"],
@@ -171,16 +241,12 @@ def add_month_section(pdf: ReportPDF, df: pd.DataFrame, period_m: pd.Period):
             col_widths=[pdf.epw * 0.55, pdf.epw * 0.45],
         )
     else:
-        pdf.cell(0, 6, txt="本月无支出数据", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.cell(0, 6, "本月无支出数据", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
 
     # Top 商家（支出）
     pdf.h3(f"Top 商家（支出，前 {TOP_MERCHANTS}）")
-    if not exp.empty:
-        merchants = (exp.groupby("merchant")["amount"]
-                       .sum()
-                       .sort_values(ascending=False)
-                       .head(TOP_MERCHANTS))
-        mer_rows = [[k, fmt_money(v)] for k, v in merchants.items()]
+    if ms["has_exp"]:
+        mer_rows = [[k, fmt_money(v)] for k, v in ms["merchants"].items()]
         pdf.table(
             title="",
             headers=["商家", "金额"],
@@ -188,20 +254,16 @@ def add_month_section(pdf: ReportPDF, df: pd.DataFrame, period_m: pd.Period):
             col_widths=[pdf.epw * 0.7, pdf.epw * 0.3],
         )
     else:
-        pdf.cell(0, 6, txt="本月无支出商家", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.cell(0, 6, "本月无支出商家", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
 
     # 大额支出
     pdf.h3(f"大额支出（Top {BIG_TOP}" + (f"，门槛≥{fmt_money(BIG_MIN)}" if BIG_MIN>0 else "") + "）")
-    if not exp.empty:
-        big_df = exp.copy()
-        if BIG_MIN > 0:
-            big_df = big_df[big_df["amount"] >= BIG_MIN]
-        big_df = big_df.sort_values("amount", ascending=False).head(BIG_TOP)
-
+    if ms["has_exp"]:
         big_rows = []
-        for _, r in big_df.iterrows():
-            dstr = pd.Timestamp(r["date"]).strftime("%Y-%m-%d")
-            big_rows.append([dstr, str(r["merchant"]), str(r.get("item") or r.get("note") or ""), fmt_money(r["amount"]), str(r["category"])])
+        cols = ["date", "merchant", "item", "note", "amount", "category"]
+        for dt, merch, item_, note_, amt, cat in ms["big"][cols].itertuples(index=False, name=None):
+            dstr = pd.Timestamp(dt).strftime("%Y-%m-%d")
+            big_rows.append([dstr, str(merch), str(item_ or note_ or ""), fmt_money(amt), str(cat)])
 
         pdf.table(
             title="",
@@ -210,7 +272,7 @@ def add_month_section(pdf: ReportPDF, df: pd.DataFrame, period_m: pd.Period):
             col_widths=[pdf.epw*0.18, pdf.epw*0.28, pdf.epw*0.30, pdf.epw*0.14, pdf.epw*0.10],
         )
     else:
-        pdf.cell(0, 6, txt="无大额支出", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.cell(0, 6, "无大额支出", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
 
     # 分隔线
     pdf.ln(2)
@@ -232,11 +294,11 @@ def main():
     pdf.h1("年度财务总览（最近12个月）")
     date_min = df["date"].min().strftime("%Y-%m-%d")
     date_max = df["date"].max().strftime("%Y-%m-%d")
-    pdf.cell(0, 8, txt=f"数据区间：{date_min} 至 {date_max}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.cell(0, 8, f"数据区间：{date_min} 至 {date_max}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
 
     # 12个月累计 KPI
-    exp_all = float(df[df["type"].astype(str).str.contains("支出", na=False)]["amount"].sum())
-    inc_all = float(df[df["type"].astype(str).str.contains("收入", na=False)]["amount"].sum())
+    exp_all = float(df.loc[df["is_expense"], "amount"].sum())
+    inc_all = float(df.loc[~df["is_expense"], "amount"].sum())
     pdf.table(
         title="12个月累计 KPI",
         headers=["指标", "金额"],
@@ -250,10 +312,14 @@ def main():
 
     # 最近12个月（近→远）
     months = month_periods_recent(MONTHS_BACK)
+    summary = summarize_months(df)
     for m in months:
-        add_month_section(pdf, df, m)
+        add_month_section(pdf, summary, m)
 
-    pdf.output(OUTPUT_PDF)
+    # 先在内存里生成完整 PDF（fpdf2 不传文件名时返回 bytearray），再一次性写盘
+    data = pdf.output()
+    with open(OUTPUT_PDF, "wb") as f:
+        f.write(data)
     print(f"✅ 报告已生成：{OUTPUT_PDF}")
 
 